@@ -1,15 +1,171 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
 from jose.exceptions import JWKError
-import requests
+from cachetools import TLRUCache
+from pydantic import ValidationError
+import asyncio
+import httpx
+import logging
 import os
+import time
 from typing import Optional
 from models import User
 
 
+logger = logging.getLogger(__name__)
+
 security = HTTPBearer()
 
+# Auth0 settings are read once at import (main.py loads .env before importing us)
+_DOMAIN = os.getenv('AUTH0_DOMAIN')
+_AUDIENCE = os.getenv('AUTH0_AUDIENCE')
+_ALGORITHMS = [os.getenv('AUTH0_ALGORITHMS', 'RS256')]
+_ISSUER = f"https://{_DOMAIN}/"
+_JWKS_URL = f"https://{_DOMAIN}/.well-known/jwks.json"
+
+# How long a fetched JWKS is trusted before it is revalidated
+JWKS_CACHE_TTL = 600  # 10 minutes
+# Minimum gap between refreshes triggered by an unknown `kid`
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+_jwks_cache = {"keys": None, "expires": 0, "by_kid": {}, "etag": None, "fetched": 0}
+# Parsed public keys per `kid`, rebuilt only when the JWKS changes
+_pubkey_cache: dict[str, Key] = {}
+_jwks_lock = asyncio.Lock()
+# Shared keep-alive client so JWKS refreshes reuse one pooled TLS connection
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=20)
+)
+
+
+def _payload_expiry(token: str, payload: dict, now: float) -> float:
+    # Keep a verified payload only until the token itself expires
+    return now + (payload["exp"] - time.time())
+
+
+# Verified payloads keyed by raw token; failed validations are never stored
+_payload_cache = TLRUCache(maxsize=10_000, ttu=_payload_expiry, timer=time.monotonic)
+
+
+async def _refresh_jwks():
+    """
+    Fetch the JWKS from Auth0, revalidating with the stored ETag when possible
+    """
+    headers = {}
+    if _jwks_cache["etag"] and _jwks_cache["keys"] is not None:
+        headers["If-None-Match"] = _jwks_cache["etag"]
+
+    response = await _http.get(_JWKS_URL, headers=headers)
+    now = time.monotonic()
+    _jwks_cache["fetched"] = now
+
+    if response.status_code == 304:
+        # Keys unchanged - just extend the current cache entry
+        _jwks_cache["expires"] = now + JWKS_CACHE_TTL
+        return
+
+    response.raise_for_status()
+    jwks = response.json()
+
+    _jwks_cache["keys"] = jwks["keys"]
+    _jwks_cache["by_kid"] = {key["kid"]: key for key in jwks["keys"] if "kid" in key}
+
+    # Parse every key once here instead of on each jwt.decode call
+    pubkeys = {}
+    for kid, key in _jwks_cache["by_kid"].items():
+        try:
+            pubkeys[kid] = jwk.construct({
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key.get("use", "sig"),
+                "n": key["n"],
+                "e": key["e"]
+            }, algorithm=_ALGORITHMS[0])
+        except (JWKError, KeyError) as e:
+            logger.warning("Skipping unusable JWK %s: %s", kid, e)
+    _pubkey_cache.clear()
+    _pubkey_cache.update(pubkeys)
+    _jwks_cache["etag"] = response.headers.get("ETag")
+    _jwks_cache["expires"] = now + JWKS_CACHE_TTL
+
+
+async def _get_signing_key(kid: str) -> Optional[Key]:
+    """
+    Look up a parsed signing key by `kid`, hitting the network only when the
+    cache is stale or the key is unknown
+    """
+    # Phase 1: serve fresh cached keys without any I/O
+    if time.monotonic() < _jwks_cache["expires"]:
+        key = _pubkey_cache.get(kid)
+        if key is not None:
+            return key
+
+    # Phase 2: refresh once, letting concurrent callers share the result
+    async with _jwks_lock:
+        now = time.monotonic()
+        key = _pubkey_cache.get(kid)
+        expired = now >= _jwks_cache["expires"]
+        unknown = key is None and now - _jwks_cache["fetched"] >= JWKS_MIN_REFRESH_INTERVAL
+
+        if expired or unknown:
+            await _refresh_jwks()
+            key = _pubkey_cache.get(kid)
+
+    return key
+
+
+async def _verify_token(token: str) -> Optional[dict]:
+    """
+    Verify a token's signature and claims against the Auth0 JWKS
+    Returns the payload, or None if the token is not valid
+    """
+    try:
+        # Get the algorithm from token header
+        unverified_header = jwt.get_unverified_header(token)
+        
+        # Find the correct (already parsed) key
+        rsa_key = await _get_signing_key(unverified_header["kid"])
+        
+        if rsa_key is not None:
+            payload = jwt.decode(
+                token,
+                rsa_key,
+                algorithms=_ALGORITHMS,
+                audience=_AUDIENCE,
+                issuer=_ISSUER
+            )
+            return payload
+    except JWTError as e:
+        logger.warning("JWT Error: %s", e)
+        return None
+    except JWKError as e:
+        logger.warning("JWK Error: %s", e)
+        return None
+    except KeyError as e:
+        logger.warning("Token header is missing %s", e)
+        return None
+    except httpx.HTTPError as e:
+        logger.error("Could not fetch Auth0 JWKS: %s", e)
+        return None
+    return None
+
+
+async def _decode_token_cached(token: str) -> Optional[dict]:
+    """
+    Decode a token, serving repeat tokens from the payload cache
+    (lru_cache-style decorators would memoize the coroutine, not its result)
+    """
+    payload = _payload_cache.get(token)
+    if payload is None:
+        payload = await _verify_token(token)
+        if payload is not None and "exp" in payload:
+            _payload_cache[token] = payload
+    return payload
+
 
 class Auth0JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
@@ -23,91 +179,41 @@ class Auth0JWTBearer(HTTPBearer):
                     detail="Invalid authentication scheme."
                 )
             
-            if not self.verify_jwt(credentials.credentials):
+            payload = await self.decode_token(credentials.credentials)
+            if payload is None:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN, 
                     detail="Invalid token or expired token."
                 )
             
-            return credentials.credentials
+            return payload
         else:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN, 
                 detail="Invalid authorization code."
             )
 
-    def verify_jwt(self, token: str) -> bool:
-        try:
-            payload = self.decode_token(token)
-            return payload is not None
-        except:
-            return False
-
-    def decode_token(self, token: str) -> Optional[dict]:
-        try:
-            # Get the key from Auth0
-            jwks_url = f"https://{os.getenv('AUTH0_DOMAIN')}/.well-known/jwks.json"
-            jwks = requests.get(jwks_url).json()
-            
-            # Get the algorithm from token header
-            unverified_header = jwt.get_unverified_header(token)
-            
-            # Find the correct key
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"]
-                    }
-                    break
-            
-            if rsa_key:
-                payload = jwt.decode(
-                    token,
-                    rsa_key,
-                    algorithms=[os.getenv('AUTH0_ALGORITHMS', 'RS256')],
-                    audience=os.getenv('AUTH0_AUDIENCE'),
-                    issuer=f"https://{os.getenv('AUTH0_DOMAIN')}/"
-                )
-                return payload
-        except JWTError as e:
-            print(f"JWT Error: {e}")
-            return None
-        except JWKError as e:
-            print(f"JWK Error: {e}")
-            return None
-        except Exception as e:
-            print(f"General Error: {e}")
-            return None
-        return None
+    async def decode_token(self, token: str) -> Optional[dict]:
+        return await _decode_token_cached(token)
 
 
 auth_handler = Auth0JWTBearer()
 
 
-async def get_current_user(token: str = Depends(auth_handler)) -> User:
+async def close_http_client():
+    """
+    Close the shared Auth0 HTTP client (called on application shutdown)
+    """
+    await _http.aclose()
+
+
+async def get_current_user(payload: dict = Depends(auth_handler)) -> User:
     """
-    Extract user information from the JWT token
+    Extract user information from the already verified JWT payload
     """
     try:
-        payload = auth_handler.decode_token(token)
-        if payload is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials"
-            )
-        
-        user = User(
-            sub=payload.get("sub"),
-            email=payload.get("email"),
-            name=payload.get("name")
-        )
-        return user
-    except Exception as e:
+        return User.model_validate(payload)
+    except ValidationError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
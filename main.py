@@ -1,18 +1,34 @@
 from fastapi import FastAPI, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import logging
+import logging.handlers
 import os
-from typing import List, Dict, Any
+import queue
+from typing import List, Dict, Any, Optional
 
 # Load environment variables FIRST
 load_dotenv()
 
+# Route log records through a queue so request handlers never block on
+# stdout; a listener thread does the actual writing
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, logging.StreamHandler(), respect_handler_level=True
+)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+_log_listener.start()
+
 from models import User
 from routers.price import router as price_router
 from services.db import db_service
-from auth.auth0 import get_current_user
+from services.currency import currency_service
+from auth.auth0 import get_current_user, close_http_client
 
 
 @asynccontextmanager
@@ -38,6 +54,15 @@ async def lifespan(app: FastAPI):
         print("Database connection closed")
     except Exception as e:
         print(f"Error closing database connection: {e}")
+    try:
+        await close_http_client()
+    except Exception as e:
+        print(f"Error closing Auth0 HTTP client: {e}")
+    try:
+        await currency_service.aclose()
+    except Exception as e:
+        print(f"Error closing currency HTTP client: {e}")
+    _log_listener.stop()
 
 
 # Create FastAPI app
@@ -47,6 +72,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -67,14 +93,22 @@ app.include_router(price_router)
 @app.get("/api/v1/user/suggestions")
 async def get_user_suggestions(
     limit: int = 50,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """
     Get user's pricing suggestion history
+    Pass a comma-separated `fields` list to fetch only those fields
     """
     try:
-        suggestions = await db_service.get_user_suggestions(current_user, limit)
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        suggestions = await db_service.get_user_suggestions(current_user, limit, fields=field_list)
         return {"suggestions": suggestions}
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     except Exception as e:
         print(f"Error in get_user_suggestions: {str(e)}")
         raise HTTPException(
@@ -155,8 +189,7 @@ async def get_system_info():
             }
             try:
                 # Get collection stats
-                collection = db_service.database[db_service.collection_name]
-                total_suggestions = await collection.count_documents({})
+                total_suggestions = await db_service.collection.count_documents({})
                 db_stats["total_price_suggestions"] = total_suggestions
             except:
                 db_stats["total_price_suggestions"] = "unknown"
@@ -23,6 +23,8 @@ PyObjectId = Annotated[str, Field(description="MongoDB ObjectId as string")]
 
 class PriceRecommendationRequest(BaseModel):
     model_config = ConfigDict(
+        # Requests are never mutated; frozen also makes them hashable
+        frozen=True,
         json_schema_extra={
             "example": {
                 "cost_price": 10.0,
@@ -39,6 +41,7 @@ class PriceRecommendationRequest(BaseModel):
     inventory_level: str = Field(..., description="Inventory level: low, medium, high")
     season: str = Field(..., description="Current season")
     category: str = Field(..., description="Product category")
+    no_cache: bool = Field(False, exclude=True, description="Bypass cached recommendations")
 
 
 class PriceRecommendationResponse(BaseModel):
@@ -70,6 +73,9 @@ class CSVUploadResponse(BaseModel):
 
 
 class User(BaseModel):
+    # Built straight from JWT payloads, so unrelated claims are dropped
+    model_config = ConfigDict(extra="ignore")
+    
     sub: str  # Auth0 user ID
     email: Optional[str] = None
     name: Optional[str] = None
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
+import asyncio
+import numpy as np
 import pandas as pd
-import io
 from typing import List
 from models import (
     PriceRecommendationRequest, 
@@ -17,6 +18,62 @@ from auth.auth0 import get_current_user
 router = APIRouter(prefix="/api/v1", tags=["pricing"])
 gemini_service = GeminiService()
 
+# Maximum number of Gemini requests in flight for a single CSV upload
+GEMINI_CONCURRENCY = 16
+
+# CSV columns read from uploads; anything else is skipped by the parser
+CSV_COLUMNS = ('cost_price', 'competitor_price', 'inventory_level', 'season', 'category')
+CSV_DTYPES = {'inventory_level': str, 'season': str, 'category': str}
+CSV_CHUNK_SIZE = 1000
+
+
+def _validate_chunk(chunk: pd.DataFrame) -> tuple[list, list]:
+    """
+    Validate a chunk of CSV rows in bulk
+    Returns: (pending (row_index, request) pairs, failed row results)
+    """
+    rows = len(chunk)
+    
+    # Extract columns into native arrays once instead of per-row Series lookups
+    cost = pd.to_numeric(chunk['cost_price'], errors='coerce').to_numpy(dtype=np.float64)
+    if 'competitor_price' in chunk.columns:
+        comp = pd.to_numeric(chunk['competitor_price'], errors='coerce').to_numpy(dtype=np.float64)
+        comp_given = chunk['competitor_price'].notna().to_numpy()
+    else:
+        comp = np.full(rows, np.nan)
+        comp_given = np.zeros(rows, dtype=bool)
+    inventory = chunk['inventory_level'].astype(str).to_numpy()
+    season = chunk['season'].astype(str).to_numpy()
+    category = chunk['category'].astype(str).to_numpy()
+    
+    cost_valid = cost > 0
+    comp_valid = (np.isnan(comp) & ~comp_given) | (comp > 0)
+    valid = cost_valid & comp_valid
+    
+    pending = []
+    failed = []
+    for i, (index, c, cp, iv, se, ca) in enumerate(zip(chunk.index, cost, comp, inventory, season, category)):
+        if not valid[i]:
+            field = "cost_price" if not cost_valid[i] else "competitor_price"
+            failed.append({
+                "row_number": index + 1,
+                "product_data": chunk.iloc[i].to_dict(),
+                "error": f"Invalid {field}: must be a number greater than 0",
+                "status": "failed"
+            })
+            continue
+        
+        # Columns were range/type-checked above, so skip per-row validation
+        pending.append((index, PriceRecommendationRequest.model_construct(
+            cost_price=float(c),
+            competitor_price=None if np.isnan(cp) else float(cp),
+            inventory_level=iv,
+            season=se,
+            category=ca
+        )))
+    
+    return pending, failed
+
 
 @router.post("/recommend-price", response_model=PriceRecommendationResponse)
 async def recommend_price(request: PriceRecommendationRequest):
@@ -70,7 +127,7 @@ async def recommend_price_authenticated(
         )
 
 
-@router.post("/upload-csv", response_model=CSVUploadResponse)
+@router.post("/upload-csv", response_model=CSVUploadResponse, response_class=ORJSONResponse)
 async def upload_csv(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
@@ -93,70 +150,94 @@ async def upload_csv(
         )
     
     try:
-        # Read CSV file
-        contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        
-        # Validate required columns
-        required_columns = ['cost_price', 'inventory_level', 'season', 'category']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Missing required columns: {missing_columns}"
-            )
+        # Stream the spooled upload through pandas in chunks instead of
+        # materialising the whole file (bytes -> str -> StringIO) in memory
+        reader = pd.read_csv(
+            file.file,
+            encoding='utf-8',
+            usecols=lambda column: column in CSV_COLUMNS,
+            dtype=CSV_DTYPES,
+            chunksize=CSV_CHUNK_SIZE
+        )
         
-        total_products = len(df)
+        total_products = 0
         successful_predictions = 0
         failed_predictions = 0
         results = []
         suggestions_to_save = []
+        pending = []
+        tasks = []
         
-        # Process each row
-        for index, row in df.iterrows():
-            try:
-                # Create request object
-                request_data = PriceRecommendationRequest(
-                    cost_price=float(row['cost_price']),
-                    competitor_price=float(row['competitor_price']) if pd.notna(row.get('competitor_price')) else None,
-                    inventory_level=str(row['inventory_level']),
-                    season=str(row['season']),
-                    category=str(row['category'])
-                )
-                
-                # Get recommendation
-                recommendation = await gemini_service.get_price_recommendation(request_data)
-                
-                result = {
+        # Issue the Gemini calls concurrently, capped at GEMINI_CONCURRENCY in flight
+        semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+        
+        async def _bounded(request_data: PriceRecommendationRequest):
+            async with semaphore:
+                return await gemini_service.get_price_recommendation(request_data)
+        
+        try:
+            with reader:
+                for chunk in reader:
+                    # Validate required columns
+                    required_columns = ['cost_price', 'inventory_level', 'season', 'category']
+                    missing_columns = [col for col in required_columns if col not in chunk.columns]
+                    
+                    if missing_columns:
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Missing required columns: {missing_columns}"
+                        )
+                    
+                    total_products += len(chunk)
+                    chunk_pending, chunk_failed = _validate_chunk(chunk)
+                    results.extend(chunk_failed)
+                    failed_predictions += len(chunk_failed)
+                    
+                    # Start this chunk's Gemini calls before parsing the next one
+                    pending.extend(chunk_pending)
+                    tasks.extend(
+                        asyncio.create_task(_bounded(request_data))
+                        for _, request_data in chunk_pending
+                    )
+                    await asyncio.sleep(0)
+        except BaseException:
+            # Don't leave Gemini calls running for an upload that failed mid-stream
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        recommendations = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        for (index, request_data), recommendation in zip(pending, recommendations):
+            if isinstance(recommendation, Exception):
+                results.append({
                     "row_number": index + 1,
                     "product_data": request_data.dict(),
-                    "suggested_price": recommendation.suggested_price,
-                    "reasoning": recommendation.reasoning,
-                    "confidence_score": recommendation.confidence_score,
-                    "status": "success"
-                }
-                
-                results.append(result)
-                successful_predictions += 1
-                
-                # Prepare for database save
-                suggestions_to_save.append({
-                    "product_data": request_data.dict(),
-                    "suggested_price": recommendation.suggested_price,
-                    "reasoning": recommendation.reasoning,
-                    "confidence_score": recommendation.confidence_score
-                })
-                
-            except Exception as e:
-                result = {
-                    "row_number": index + 1,
-                    "product_data": row.to_dict(),
-                    "error": str(e),
+                    "error": str(recommendation),
                     "status": "failed"
-                }
-                results.append(result)
+                })
                 failed_predictions += 1
+                continue
+            
+            results.append({
+                "row_number": index + 1,
+                "product_data": request_data.dict(),
+                "suggested_price": recommendation.suggested_price,
+                "reasoning": recommendation.reasoning,
+                "confidence_score": recommendation.confidence_score,
+                "status": "success"
+            })
+            successful_predictions += 1
+            
+            # Prepare for database save
+            suggestions_to_save.append({
+                "product_data": request_data.dict(),
+                "suggested_price": recommendation.suggested_price,
+                "reasoning": recommendation.reasoning,
+                "confidence_score": recommendation.confidence_score
+            })
+        
+        results.sort(key=lambda result: result["row_number"])
         
         # Save successful suggestions to database
         if suggestions_to_save:
@@ -201,14 +282,12 @@ async def get_suggestion_history(
     Protected endpoint requiring Auth0 JWT authentication
     """
     try:
-        suggestions = await db_service.get_user_suggestions(
+        suggestions, stats = await db_service.get_page_with_stats(
             user=current_user,
             limit=limit,
             skip=skip
         )
         
-        stats = await db_service.get_suggestions_stats(current_user)
-        
         return {
             "suggestions": suggestions,
             "pagination": {
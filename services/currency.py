@@ -1,7 +1,25 @@
+import asyncio
 import httpx
+import numpy as np
 import os
+import time
 from typing import Dict, Optional
-from datetime import datetime, timedelta
+from types import MappingProxyType
+
+
+# Static currency metadata, shared read-only across calls
+_CURRENCY_INFO = MappingProxyType({
+    "USD": {"name": "US Dollar", "symbol": "$"},
+    "EUR": {"name": "Euro", "symbol": "€"},
+    "GBP": {"name": "British Pound", "symbol": "£"},
+    "JPY": {"name": "Japanese Yen", "symbol": "¥"},
+    "CAD": {"name": "Canadian Dollar", "symbol": "C$"},
+    "AUD": {"name": "Australian Dollar", "symbol": "A$"},
+    "CHF": {"name": "Swiss Franc", "symbol": "CHF"},
+    "CNY": {"name": "Chinese Yuan", "symbol": "¥"},
+    "INR": {"name": "Indian Rupee", "symbol": "₹"},
+    "KRW": {"name": "South Korean Won", "symbol": "₩"}
+})
 
 
 class CurrencyExchangeService:
@@ -11,9 +29,11 @@ class CurrencyExchangeService:
     
     def __init__(self):
         self.base_url = "https://api.exchangerate-api.com/v4/latest"
-        self.cache = {}
-        self.cache_expiry = {}
-        self.cache_duration = timedelta(hours=1)  # Cache for 1 hour
+        # cache_key -> (monotonic expiry, rates)
+        self.cache: Dict[str, tuple[float, Dict[str, float]]] = {}
+        self.cache_duration = 3600.0  # Cache for 1 hour
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
         
         # Fallback exchange rates (approximate)
         self.fallback_rates = {
@@ -28,38 +48,83 @@ class CurrencyExchangeService:
             "INR": 74.0,
             "KRW": 1180.0
         }
+        
+        # Precompute the full fallback conversion table once:
+        # self._fallback_matrix[i][j] is the rate from currency i to currency j
+        self._ccy_codes = tuple(self.fallback_rates)
+        self._ccy_index = {currency: i for i, currency in enumerate(self._ccy_codes)}
+        rates = np.fromiter(self.fallback_rates.values(), dtype=np.float64)
+        self._fallback_matrix = rates[np.newaxis, :] / rates[:, np.newaxis]
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Lazily create the shared HTTP client so refreshes reuse a warm connection
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=10.0,
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=10)
+            )
+        return self._client
+    
+    async def aclose(self):
+        """
+        Close the shared HTTP client (called on application shutdown)
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def get_exchange_rates(self, base_currency: str = "USD") -> Dict[str, float]:
         """
         Get current exchange rates for a base currency
         """
+        # Check cache first
+        cache_key = f"rates_{base_currency}"
+        cached = self.cache.get(cache_key)
+        if cached is not None and time.monotonic() < cached[0]:
+            print(f"💰 Using cached exchange rates for {base_currency}")
+            return cached[1]
+        
+        # Coalesce concurrent misses into a single in-flight fetch
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            rates = await self._fetch_exchange_rates(base_currency, cache_key)
+            future.set_result(rates)
+            return rates
+        finally:
+            if not future.done():
+                # The fetching caller was cancelled; waiters get the fallback
+                future.set_result(self._get_fallback_rates(base_currency))
+            self._inflight.pop(cache_key, None)
+    
+    async def _fetch_exchange_rates(self, base_currency: str, cache_key: str) -> Dict[str, float]:
+        """
+        Fetch exchange rates from the API and cache them, falling back on error
+        """
         try:
-            # Check cache first
-            cache_key = f"rates_{base_currency}"
-            if (cache_key in self.cache and 
-                cache_key in self.cache_expiry and
-                datetime.now() < self.cache_expiry[cache_key]):
-                print(f"💰 Using cached exchange rates for {base_currency}")
-                return self.cache[cache_key]
-            
             # Fetch from API
             print(f"💱 Fetching live exchange rates for {base_currency}")
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.base_url}/{base_currency}")
+            response = await self._get_client().get(f"{self.base_url}/{base_currency}")
+            
+            if response.status_code == 200:
+                data = response.json()
+                rates = data.get("rates", {})
+                
+                # Cache the results
+                self.cache[cache_key] = (time.monotonic() + self.cache_duration, rates)
+                
+                return rates
+            else:
+                print(f"⚠️ Exchange API returned {response.status_code}, using fallback")
+                return self._get_fallback_rates(base_currency)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    rates = data.get("rates", {})
-                    
-                    # Cache the results
-                    self.cache[cache_key] = rates
-                    self.cache_expiry[cache_key] = datetime.now() + self.cache_duration
-                    
-                    return rates
-                else:
-                    print(f"⚠️ Exchange API returned {response.status_code}, using fallback")
-                    return self._get_fallback_rates(base_currency)
-                    
         except Exception as e:
             print(f"❌ Error fetching exchange rates: {e}, using fallback")
             return self._get_fallback_rates(base_currency)
@@ -68,17 +133,9 @@ class CurrencyExchangeService:
         """
         Get fallback exchange rates when API is unavailable
         """
-        if base_currency == "USD":
-            return self.fallback_rates.copy()
-        
-        # Convert fallback rates to the requested base currency
-        base_rate = self.fallback_rates.get(base_currency, 1.0)
-        converted_rates = {}
-        
-        for currency, rate in self.fallback_rates.items():
-            converted_rates[currency] = rate / base_rate
-        
-        return converted_rates
+        # Unknown base currencies are treated as USD
+        i = self._ccy_index.get(base_currency, self._ccy_index["USD"])
+        return dict(zip(self._ccy_codes, self._fallback_matrix[i].tolist()))
     
     async def convert_currency(self, 
                              amount: float, 
@@ -119,27 +176,14 @@ class CurrencyExchangeService:
         """
         return list(self.fallback_rates.keys())
     
-    async def get_currency_info(self, currency: str) -> Dict[str, str]:
+    def get_currency_info(self, currency: str) -> Dict[str, str]:
         """
         Get information about a currency
         """
-        currency_info = {
-            "USD": {"name": "US Dollar", "symbol": "$"},
-            "EUR": {"name": "Euro", "symbol": "€"},
-            "GBP": {"name": "British Pound", "symbol": "£"},
-            "JPY": {"name": "Japanese Yen", "symbol": "¥"},
-            "CAD": {"name": "Canadian Dollar", "symbol": "C$"},
-            "AUD": {"name": "Australian Dollar", "symbol": "A$"},
-            "CHF": {"name": "Swiss Franc", "symbol": "CHF"},
-            "CNY": {"name": "Chinese Yuan", "symbol": "¥"},
-            "INR": {"name": "Indian Rupee", "symbol": "₹"},
-            "KRW": {"name": "South Korean Won", "symbol": "₩"}
-        }
-        
-        return currency_info.get(currency.upper(), {
-            "name": currency.upper(),
-            "symbol": currency.upper()
-        })
+        code = currency.upper()
+        # Copied so callers can't mutate the shared metadata
+        info = _CURRENCY_INFO.get(code)
+        return dict(info) if info else {"name": code, "symbol": code}
 
 
 # Global currency service instance
@@ -1,71 +1,250 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+import asyncio
+import logging
 import os
 import ssl
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-from models import PriceSuggestion, User
+from models import PriceRecommendationRequest, PriceSuggestion, User
 from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
 from .local_storage import local_storage
 
+logger = logging.getLogger(__name__)
+
+
+# Single suggestion saves are buffered and flushed together with insert_many
+WRITE_BATCH_SIZE = int(os.getenv("MONGODB_WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("MONGODB_WRITE_BATCH_MS", "20")) / 1000  # seconds
+
+# How long per-user stats aggregates are served from memory
+STATS_CACHE_TTL = 60.0  # seconds
+
+# Gemini recommendations are cached by request signature for this long
+RECOMMENDATION_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Field paths a caller may project suggestions down to
+PROJECTABLE_FIELDS = frozenset(
+    [field.alias or name for name, field in PriceSuggestion.model_fields.items()]
+    + [f"product_data.{name}" for name, field in PriceRecommendationRequest.model_fields.items()
+       if not field.exclude]
+)
+
+# Connection pool sizing; MIN_POOL_SIZE connections are opened at startup
+MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "128"))
+MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "16"))
+
+
+class _PendingBuffer:
+    """
+    Coalesces single-document inserts into unordered insert_many batches.
+    Each caller awaits a future that resolves to its inserted id (or raises
+    the error for its document) once the batch containing it is written.
+    """
+    def __init__(self, collection, 
+                 batch_size: int = WRITE_BATCH_SIZE, 
+                 batch_interval: float = WRITE_FLUSH_INTERVAL):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start the background batch writer"""
+        self._task = asyncio.create_task(self._run())
+    
+    async def insert(self, document: dict) -> str:
+        """Queue a document and wait until its batch has been written"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((document, future))
+        return await future
+    
+    async def flush(self):
+        """Wait until every queued document has been written"""
+        await self._queue.join()
+    
+    async def stop(self):
+        """Flush pending documents and stop the background writer"""
+        await self.flush()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first document, then gather more until the batch
+            # is full or batch_interval has passed
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _write(self, batch: List[tuple]):
+        documents = [document for document, _ in batch]
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+            errors = {}
+        except BulkWriteError as e:
+            # Unordered insert: the rest of the batch still went through
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for i, (document, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(Exception(errors[i].get("errmsg", "Write error")))
+            else:
+                future.set_result(str(document["_id"]))
+
 
 class DatabaseService:
     def __init__(self):
         self.client: Optional[AsyncIOMotorClient] = None
         self.database = None
+        self.collection = None
         self.collection_name = "price_suggestions"
+        self.recommendation_cache_name = "gemini_cache"
+        self._pending: Optional[_PendingBuffer] = None
+        # user_id -> running aggregates, expiring after STATS_CACHE_TTL
+        self._stats_cache = TTLCache(maxsize=10_000, ttl=STATS_CACHE_TTL)
+        # user_id -> number of inserts recorded so far; an aggregation is only
+        # cached if this hasn't moved since it started
+        self._stats_generation: Dict[str, int] = {}
+        # user_id -> True for users with an unacknowledged write in the last
+        # STATS_CACHE_TTL seconds, whose aggregations aren't cached
+        self._unacked_writes = TTLCache(maxsize=10_000, ttl=STATS_CACHE_TTL)
     
     async def connect(self):
         """Connect to MongoDB Atlas"""
         try:
             mongodb_url = os.getenv("MONGODB_URL")
             if not mongodb_url:
-                print("❌ MONGODB_URL environment variable is not set")
+                logger.error("MONGODB_URL environment variable is not set")
                 self.client = None
                 self.database = None
+                self.collection = None
                 return
             
-            print(f"🔗 Connecting to MongoDB...")
+            logger.info("Connecting to MongoDB...")
             
-            # Try the simplest possible connection first
-            self.client = AsyncIOMotorClient(mongodb_url)
+            # zstd needs the zstandard package; the driver falls back to zlib
+            # (or no compression) if the server doesn't negotiate it
+            self.client = AsyncIOMotorClient(
+                mongodb_url,
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                maxIdleTimeMS=30000,
+                serverSelectionTimeoutMS=5000,
+                compressors="zstd,zlib",
+            )
             
             # Test connection with a short timeout
             await self.client.admin.command('ping', maxTimeMS=5000)
-            print("✅ Successfully connected to MongoDB Atlas")
+            logger.info("Successfully connected to MongoDB Atlas")
             
             # Get database
             self.database = self.client.gemprice
-            print("✅ Database 'gemprice' ready")
+            self.collection = self.database[self.collection_name]
+            logger.info("Database 'gemprice' ready")
+            
+            # Open the minimum pool up front with concurrent no-op reads so
+            # early requests don't pay for connection setup and TLS
+            await asyncio.gather(
+                *(self.collection.find_one({}, {"_id": 1})
+                  for _ in range(MIN_POOL_SIZE)),
+                return_exceptions=True,
+            )
+            
+            # History reads match on user_id and sort newest first; a compound
+            # index lets them walk the index instead of sorting in memory
+            try:
+                await self.collection.create_index(
+                    [("user_id", 1), ("timestamp", -1)]
+                )
+            except Exception as e:
+                logger.warning("Could not create suggestion history index: %s", e)
+            
+            # Let MongoDB expire cached Gemini recommendations on its own
+            try:
+                await self.database[self.recommendation_cache_name].create_index(
+                    "ts", expireAfterSeconds=RECOMMENDATION_CACHE_TTL
+                )
+            except Exception as e:
+                logger.warning("Could not create recommendation cache TTL index: %s", e)
+            
+            # Start the buffered writer for single suggestion saves
+            self._pending = _PendingBuffer(self.collection)
+            self._pending.start()
             
         except Exception as e:
-            print(f"❌ Error connecting to MongoDB: {e}")
-            print("📝 Database features will be limited without connection")
-            # Set both to None so we know connection failed
+            logger.error("Error connecting to MongoDB: %s", e)
+            logger.warning("Database features will be limited without connection")
+            # Clear the handles so we know connection failed
             self.client = None
             self.database = None
+            self.collection = None
     
     async def disconnect(self):
         """Disconnect from MongoDB"""
+        if self._pending:
+            # Let the writer flush whatever is still buffered, then stop it
+            await self._pending.stop()
+            self._pending = None
         if self.client:
             self.client.close()
+        self.database = None
+        self.collection = None
     
     async def save_price_suggestion(self, 
                                   user: User, 
-                                  suggestion_data: dict) -> str:
+                                  suggestion_data: dict,
+                                  fast_insert: bool = False) -> str:
         """
         Save a price suggestion to the database or local storage as fallback
         Returns the ObjectId of the saved document
+        
+        MongoDB writes are buffered and flushed in batches by a background
+        task, so a save may wait up to WRITE_FLUSH_INTERVAL for its batch.
+        With fast_insert the document is sent straight away with an
+        unacknowledged (w=0) write concern and the call returns without
+        waiting for the server
         """
         try:
-            if self.database is None:
-                print("📁 Using local storage fallback")
+            if self.database is None or (self._pending is None and not fast_insert):
+                logger.debug("Using local storage fallback")
                 return await local_storage.save_price_suggestion(user, suggestion_data)
-                
-            collection = self.database[self.collection_name]
             
-            # Create the document to insert
+            # Create the document to insert; the id is generated client-side
+            # so each buffered document can be matched to its caller
             document = {
+                "_id": ObjectId(),
                 "user_id": user.sub,
                 "product_data": suggestion_data.get("product_data", {}),
                 "suggested_price": suggestion_data.get("suggested_price"),
@@ -74,30 +253,65 @@ class DatabaseService:
                 "timestamp": datetime.utcnow()
             }
             
-            result = await collection.insert_one(document)
-            print("💾 Saved to MongoDB")
-            return str(result.inserted_id)
+            if fast_insert:
+                collection = self.collection.with_options(
+                    write_concern=WriteConcern(w=0)
+                )
+                await collection.insert_one(document)
+                inserted_id = str(document["_id"])
+            else:
+                inserted_id = await self._pending.insert(document)
+            logger.debug("Saved to MongoDB")
+            self._record_stats(user.sub, [document["suggested_price"]], acknowledged=not fast_insert)
+            return inserted_id
             
         except Exception as e:
-            print(f"❌ Error saving to MongoDB, using local storage: {e}")
+            logger.warning("Error saving to MongoDB, using local storage: %s", e)
             return await local_storage.save_price_suggestion(user, suggestion_data)
     
+    @staticmethod
+    def _projection(fields: Optional[List[str]]) -> Optional[dict]:
+        """
+        Build a find() projection from requested field names
+        Raises ValueError for unknown fields or overlapping paths (e.g.
+        product_data with product_data.cost_price), which MongoDB rejects
+        """
+        if not fields:
+            return None
+        
+        unknown = [field for field in fields if field not in PROJECTABLE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        
+        requested = set(fields)
+        for field in requested:
+            parent = field.rpartition(".")[0]
+            if parent and parent in requested:
+                raise ValueError(f"Overlapping fields: {parent}, {field}")
+        
+        return {field: 1 for field in requested}
+    
     async def get_user_suggestions(self, 
                                  user: User, 
                                  limit: int = 50, 
-                                 skip: int = 0) -> List[dict]:
+                                 skip: int = 0,
+                                 fields: Optional[List[str]] = None) -> List[dict]:
         """
         Get price suggestions for a specific user from database or local storage
+        
+        When `fields` is given only those fields (plus _id) are fetched from
+        MongoDB, e.g. ["suggested_price", "timestamp"] for a compact listing.
+        Raises ValueError if `fields` names anything that can't be projected
         """
+        projection = self._projection(fields)
         try:
             if self.database is None:
-                print("📁 Loading from local storage")
+                logger.debug("Loading from local storage")
                 return await local_storage.get_user_suggestions(user, limit, skip)
                 
-            collection = self.database[self.collection_name]
-            
-            cursor = collection.find(
-                {"user_id": user.sub}
+            cursor = self.collection.find(
+                {"user_id": user.sub},
+                projection=projection
             ).sort("timestamp", -1).skip(skip).limit(limit)
             
             suggestions = []
@@ -106,30 +320,36 @@ class DatabaseService:
                 document["_id"] = str(document["_id"])
                 suggestions.append(document)
             
-            print(f"📦 Loaded {len(suggestions)} suggestions from MongoDB")
+            logger.debug("Loaded %d suggestions from MongoDB", len(suggestions))
             return suggestions
             
         except Exception as e:
-            print(f"❌ Error retrieving from MongoDB, using local storage: {e}")
+            logger.warning("Error retrieving from MongoDB, using local storage: %s", e)
             return await local_storage.get_user_suggestions(user, limit, skip)
     
     async def get_suggestion_by_id(self, 
                                  suggestion_id: str, 
-                                 user: User) -> Optional[dict]:
+                                 user: User,
+                                 fields: Optional[List[str]] = None) -> Optional[dict]:
         """
         Get a specific suggestion by ID (only if it belongs to the user)
+        
+        When `fields` is given only those fields (plus _id) are fetched, so
+        summary views can skip the product_data blob. Raises ValueError if
+        `fields` names anything that can't be projected
         """
+        projection = self._projection(fields)
         try:
-            collection = self.database[self.collection_name]
-            
-            # Verify ObjectId format
-            if not ObjectId.is_valid(suggestion_id):
+            # Malformed ids can't match anything
+            try:
+                oid = ObjectId(suggestion_id)
+            except (InvalidId, TypeError):
                 return None
             
-            document = await collection.find_one({
-                "_id": ObjectId(suggestion_id),
-                "user_id": user.sub
-            })
+            document = await self.collection.find_one(
+                {"_id": oid, "user_id": user.sub},
+                projection=projection
+            )
             
             if document:
                 document["_id"] = str(document["_id"])
@@ -137,77 +357,269 @@ class DatabaseService:
             return document
             
         except Exception as e:
-            print(f"Error retrieving suggestion by ID: {e}")
+            logger.error("Error retrieving suggestion by ID: %s", e)
             raise
     
+    def _record_stats(self, 
+                      user_id: str, 
+                      prices: List[Optional[float]], 
+                      acknowledged: bool = True):
+        """
+        Fold newly inserted prices into the user's cached stats, if any
+        
+        An unacknowledged write may not have been applied yet, so instead
+        the user's entry is dropped and their aggregations go uncached for
+        STATS_CACHE_TTL seconds (no cached entry is built on a stale base)
+        """
+        self._stats_generation[user_id] = self._stats_generation.get(user_id, 0) + 1
+        
+        if not acknowledged:
+            self._unacked_writes[user_id] = True
+            self._stats_cache.pop(user_id, None)
+            return
+        
+        aggregates = self._stats_cache.get(user_id)
+        if aggregates is None:
+            return
+        
+        aggregates["total"] += len(prices)
+        for price in prices:
+            if not isinstance(price, (int, float)):
+                continue
+            aggregates["priced"] += 1
+            aggregates["sum"] += price
+            aggregates["min"] = price if aggregates["min"] is None else min(aggregates["min"], price)
+            aggregates["max"] = price if aggregates["max"] is None else max(aggregates["max"], price)
+    
+    @staticmethod
+    def _format_stats(aggregates: dict) -> dict:
+        average = aggregates["sum"] / aggregates["priced"] if aggregates["priced"] else 0
+        return {
+            "total_suggestions": aggregates["total"],
+            "average_price": average or 0,
+            "min_price": aggregates["min"] or 0,
+            "max_price": aggregates["max"] or 0
+        }
+    
     async def get_suggestions_stats(self, user: User) -> dict:
         """
         Get statistics about user's price suggestions from database or local storage
+        
+        MongoDB results are cached per user for STATS_CACHE_TTL seconds and
+        kept current by folding in new inserts instead of re-aggregating
         """
         try:
             if self.database is None:
-                print("📁 Getting stats from local storage")
+                logger.debug("Getting stats from local storage")
                 return await local_storage.get_suggestions_stats(user)
-                
-            collection = self.database[self.collection_name]
             
-            # Count total suggestions
-            total_count = await collection.count_documents({"user_id": user.sub})
+            cached = self._stats_cache.get(user.sub)
+            if cached is not None:
+                return self._format_stats(cached)
+            
+            generation = self._stats_generation.get(user.sub, 0)
             
-            # Get average price
+            # Count and price aggregates in one pass; only suggested_price is
+            # carried past $match (sum/count rather than avg so that new
+            # inserts can be folded into the cached values)
             pipeline = [
                 {"$match": {"user_id": user.sub}},
+                {"$project": {"suggested_price": 1, "_id": 0}},
                 {"$group": {
                     "_id": None,
-                    "avg_price": {"$avg": "$suggested_price"},
+                    "total": {"$sum": 1},
+                    "sum_price": {"$sum": "$suggested_price"},
+                    "priced": {"$sum": {"$cond": [{"$isNumber": "$suggested_price"}, 1, 0]}},
                     "min_price": {"$min": "$suggested_price"},
                     "max_price": {"$max": "$suggested_price"}
                 }}
             ]
             
-            result = await collection.aggregate(pipeline).to_list(1)
+            result = await self.collection.aggregate(pipeline).to_list(1)
             
-            stats = {
-                "total_suggestions": total_count,
-                "average_price": result[0]["avg_price"] if result and result[0]["avg_price"] else 0,
-                "min_price": result[0]["min_price"] if result and result[0]["min_price"] else 0,
-                "max_price": result[0]["max_price"] if result and result[0]["max_price"] else 0
+            aggregates = {
+                "total": result[0]["total"] if result else 0,
+                "priced": result[0]["priced"] if result else 0,
+                "sum": result[0]["sum_price"] if result else 0,
+                "min": result[0]["min_price"] if result else None,
+                "max": result[0]["max_price"] if result else None
             }
             
-            print(f"📊 MongoDB stats: {stats}")
+            # Only cache if no insert landed since we started aggregating and no
+            # unacknowledged write might still be missing from the result
+            if self._stats_generation.get(user.sub, 0) == generation and user.sub not in self._unacked_writes:
+                self._stats_cache[user.sub] = aggregates
+            
+            stats = self._format_stats(aggregates)
+            logger.debug("MongoDB stats: %s", stats)
             return stats
             
         except Exception as e:
-            print(f"❌ Error getting MongoDB stats, using local storage: {e}")
+            logger.warning("Error getting MongoDB stats, using local storage: %s", e)
             return await local_storage.get_suggestions_stats(user)
     
+    async def get_page_with_stats(self, 
+                                user: User, 
+                                limit: int = 50, 
+                                skip: int = 0) -> Tuple[List[dict], dict]:
+        """
+        Get a page of the user's suggestions together with their stats
+        Returns: (suggestions, stats)
+        
+        When the stats aren't cached both come back from a single $facet
+        aggregation, saving a round trip over separate calls. An unbounded
+        page (limit <= 0) goes through the find() path instead, since the
+        whole $facet result has to fit in one document
+        """
+        try:
+            if self.database is None:
+                logger.debug("Loading page and stats from local storage")
+                return (await local_storage.get_user_suggestions(user, limit, skip),
+                        await local_storage.get_suggestions_stats(user))
+            
+            if limit <= 0 or user.sub in self._stats_cache:
+                return (await self.get_user_suggestions(user, limit, skip),
+                        await self.get_suggestions_stats(user))
+            
+            generation = self._stats_generation.get(user.sub, 0)
+            
+            # $facet sub-pipelines can't use indexes, so match+sort run
+            # first and walk the (user_id, timestamp) index
+            pipeline = [
+                {"$match": {"user_id": user.sub}},
+                {"$sort": {"timestamp": -1}},
+                {"$facet": {
+                    "page": [
+                        {"$skip": skip},
+                        {"$limit": limit}
+                    ],
+                    "stats": [
+                        {"$group": {
+                            "_id": None,
+                            "total": {"$sum": 1},
+                            "sum_price": {"$sum": "$suggested_price"},
+                            "priced": {"$sum": {"$cond": [{"$isNumber": "$suggested_price"}, 1, 0]}},
+                            "min_price": {"$min": "$suggested_price"},
+                            "max_price": {"$max": "$suggested_price"}
+                        }}
+                    ]
+                }}
+            ]
+            
+            result = await self.collection.aggregate(pipeline).to_list(1)
+            page = result[0]["page"] if result else []
+            group = result[0]["stats"] if result else []
+            
+            suggestions = []
+            for document in page:
+                document["_id"] = str(document["_id"])
+                suggestions.append(document)
+            
+            aggregates = {
+                "total": group[0]["total"] if group else 0,
+                "priced": group[0]["priced"] if group else 0,
+                "sum": group[0]["sum_price"] if group else 0,
+                "min": group[0]["min_price"] if group else None,
+                "max": group[0]["max_price"] if group else None
+            }
+            
+            # Only cache if no insert landed since we started aggregating and no
+            # unacknowledged write might still be missing from the result
+            if self._stats_generation.get(user.sub, 0) == generation and user.sub not in self._unacked_writes:
+                self._stats_cache[user.sub] = aggregates
+            
+            logger.debug("Loaded %d suggestions and stats from MongoDB", len(suggestions))
+            return suggestions, self._format_stats(aggregates)
+            
+        except Exception as e:
+            logger.warning("Error retrieving page and stats from MongoDB, using local storage: %s", e)
+            return (await local_storage.get_user_suggestions(user, limit, skip),
+                    await local_storage.get_suggestions_stats(user))
+    
+    async def get_cached_recommendation(self, key: str) -> Optional[dict]:
+        """
+        Look up a cached Gemini recommendation by request signature
+        """
+        if self.database is None:
+            return None
+        try:
+            document = await self.database[self.recommendation_cache_name].find_one({"_id": key})
+            return document["response"] if document else None
+        except Exception as e:
+            logger.error("Error reading recommendation cache: %s", e)
+            return None
+    
+    async def cache_recommendation(self, key: str, response: dict):
+        """
+        Persist a Gemini recommendation so identical requests survive restarts
+        """
+        if self.database is None:
+            return
+        try:
+            await self.database[self.recommendation_cache_name].update_one(
+                {"_id": key},
+                {"$set": {"response": response, "ts": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error("Error writing recommendation cache: %s", e)
+    
+    async def discard_cached_recommendation(self, key: str):
+        """
+        Remove a cached Gemini recommendation (e.g. one that no longer validates)
+        """
+        if self.database is None:
+            return
+        try:
+            await self.database[self.recommendation_cache_name].delete_one({"_id": key})
+        except Exception as e:
+            logger.error("Error deleting from recommendation cache: %s", e)
+    
     async def batch_save_suggestions(self, 
                                    user: User, 
-                                   suggestions: List[dict]) -> List[str]:
+                                   suggestions: List[dict],
+                                   fast_insert: bool = True) -> List[str]:
         """
         Save multiple price suggestions in batch
         Returns list of ObjectIds
+        
+        With fast_insert (the default) the batch is sent unordered with an
+        unacknowledged (w=0) write concern; pass fast_insert=False to wait
+        for the server to acknowledge the inserts
         """
         try:
-            collection = self.database[self.collection_name]
+            collection = self.collection
             
+            # The whole batch is stamped with one timestamp; the client-side
+            # ObjectIds still increase in order if a tie-breaker is needed
+            now = datetime.utcnow()
             documents = []
             for suggestion in suggestions:
                 document = {
+                    # Generated client-side since w=0 writes return no inserted_ids
+                    "_id": ObjectId(),
                     "user_id": user.sub,
                     "product_data": suggestion["product_data"],
                     "suggested_price": suggestion["suggested_price"],
                     "reasoning": suggestion["reasoning"],
                     "confidence_score": suggestion.get("confidence_score"),
-                    "timestamp": datetime.utcnow()
+                    "timestamp": now
                 }
                 documents.append(document)
             
-            result = await collection.insert_many(documents)
-            return [str(id) for id in result.inserted_ids]
+            if fast_insert:
+                collection = collection.with_options(write_concern=WriteConcern(w=0))
+            
+            await collection.insert_many(documents, ordered=False)
+            self._record_stats(
+                user.sub,
+                [document["suggested_price"] for document in documents],
+                acknowledged=not fast_insert
+            )
+            return [str(document["_id"]) for document in documents]
             
         except Exception as e:
-            print(f"Error batch saving suggestions: {e}")
+            logger.error("Error batch saving suggestions: %s", e)
             raise
 
 
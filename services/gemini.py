@@ -1,38 +1,32 @@
+import asyncio
 import os
 import json
+import string
+import hashlib
 import logging
 import google.generativeai as genai
+from cachetools import TTLCache
+from pydantic import ValidationError
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional
 from models import PriceRecommendationRequest, PriceRecommendationResponse
+from services.db import db_service, RECOMMENDATION_CACHE_TTL
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class GeminiService:
-    def __init__(self):
-        """Initialize Gemini service with API key validation"""
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is not set")
-        
-        # Configure Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        logger.info("✅ GeminiService initialized successfully")
-
-    def build_pricing_prompt(self, request: PriceRecommendationRequest) -> str:
-        """Build the prompt for Gemini API"""
-        return f"""
+# Pricing prompt; split into constant fragments around the placeholders once
+# at startup, so building a prompt is a single join
+PRICING_PROMPT_TEMPLATE = """
 You are an expert pricing consultant. Analyze the following product data and provide pricing recommendations.
 
 Product Details:
-- Cost Price: ${request.cost_price}
-- Competitor Price: ${request.competitor_price}
-- Inventory Level: {request.inventory_level}
-- Season: {request.season}
-- Category: {request.category}
+- Cost Price: ${cost_price}
+- Competitor Price: ${competitor_price}
+- Inventory Level: {inventory_level}
+- Season: {season}
+- Category: {category}
 
 Please provide a pricing recommendation with the following considerations:
 1. Maintain healthy profit margins (at least 20% above cost)
@@ -51,31 +45,119 @@ Respond with ONLY a valid JSON object in this exact format:
 No additional text, explanations, or formatting - just the JSON object.
 """
 
+class GeminiService:
+    def __init__(self):
+        """Initialize Gemini service with API key validation"""
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+        
+        # Configure Gemini
+        genai.configure(api_key=self.api_key)
+        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        
+        # The Gemini SDK is synchronous, so calls run on this pool to keep
+        # the event loop free while waiting on the network
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini")
+        
+        # Recent recommendations keyed by request signature
+        self._cache = TTLCache(maxsize=1024, ttl=RECOMMENDATION_CACHE_TTL)
+        
+        # Literal prompt text between the cost_price, competitor_price,
+        # inventory_level, season and category placeholders (escaped braces
+        # come back as separate literals, so they're folded into the fragment)
+        parts = [""]
+        for literal, field_name, _, _ in string.Formatter().parse(PRICING_PROMPT_TEMPLATE):
+            parts[-1] += literal
+            if field_name is not None:
+                parts.append("")
+        self._prompt_parts = tuple(parts)
+        
+        logger.info("✅ GeminiService initialized successfully")
+
+    def build_pricing_prompt(self, request: PriceRecommendationRequest) -> str:
+        """Build the prompt for Gemini API"""
+        parts = self._prompt_parts
+        return "".join((
+            parts[0], str(request.cost_price),
+            parts[1], str(request.competitor_price),
+            parts[2], str(request.inventory_level),
+            parts[3], str(request.season),
+            parts[4], str(request.category),
+            parts[5],
+        ))
+
+    def _generate_text(self, prompt: str) -> str:
+        """
+        Stream a Gemini response and join its chunks
+        (blocking; runs on the thread pool)
+        """
+        return "".join(chunk.text for chunk in self.model.generate_content(prompt, stream=True))
+
+    @staticmethod
+    def cache_key(request: PriceRecommendationRequest) -> str:
+        """Signature of the pricing inputs, used as the recommendation cache key"""
+        payload = json.dumps(request.model_dump(), sort_keys=True).encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
     async def get_price_recommendation(self, request: PriceRecommendationRequest) -> PriceRecommendationResponse:
-        """Get price recommendation from Gemini API"""
+        """
+        Get price recommendation, serving identical requests from the in-memory
+        cache or the persistent MongoDB cache before calling Gemini
+        """
+        use_cache = not request.no_cache
+        key = self.cache_key(request)
+        
+        if use_cache:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            
+            stored = await db_service.get_cached_recommendation(key)
+            if stored is not None:
+                try:
+                    recommendation = PriceRecommendationResponse.model_validate(stored)
+                except ValidationError as e:
+                    # Malformed or outdated entry: treat it as a miss
+                    logger.warning(f"Discarding invalid cached recommendation {key}: {e}")
+                    await db_service.discard_cached_recommendation(key)
+                else:
+                    self._cache[key] = recommendation
+                    return recommendation
+        
+        recommendation, cacheable = await self._generate_recommendation(request)
+        
+        # Fallback prices are never cached so the next request retries Gemini
+        if use_cache and cacheable:
+            self._cache[key] = recommendation
+            await db_service.cache_recommendation(key, recommendation.model_dump())
+        
+        return recommendation
+
+    async def _generate_recommendation(self, request: PriceRecommendationRequest) -> tuple[PriceRecommendationResponse, bool]:
+        """
+        Get price recommendation from Gemini API
+        Returns: (recommendation, whether it came from Gemini rather than a fallback)
+        """
         try:
             # Build prompt
             prompt = self.build_pricing_prompt(request)
             
-            # Generate response
-            response = self.model.generate_content(prompt)
+            # Generate response on a worker thread; the SDK call is blocking
+            loop = asyncio.get_running_loop()
+            text = await loop.run_in_executor(self._pool, self._generate_text, prompt)
             
-            if not response or not response.text:
+            if not text:
                 raise Exception("Empty response from Gemini API")
             
-            # Parse JSON response
+            # Parse and validate the JSON response in one pass; surrounding
+            # whitespace is valid JSON, so the text is passed through as-is
             try:
-                result = json.loads(response.text.strip())
-                
-                # Validate required fields
-                if not all(key in result for key in ['suggested_price', 'reasoning', 'confidence_score']):
-                    raise ValueError("Missing required fields in Gemini response")
-                
-                return PriceRecommendationResponse(**result)
+                return PriceRecommendationResponse.model_validate_json(text), True
                 
-            except json.JSONDecodeError as e:
+            except ValidationError as e:
                 logger.error(f"JSON parsing error: {e}")
-                logger.error(f"Raw response: {response.text}")
+                logger.error(f"Raw response: {text}")
                 
                 # Fallback pricing logic
                 markup_percentage = 1.5  # 50% markup
@@ -85,7 +167,7 @@ No additional text, explanations, or formatting - just the JSON object.
                     suggested_price=round(fallback_price, 2),
                     reasoning=f"Fallback pricing applied due to API parsing error. Applied {markup_percentage*100-100}% markup on cost price.",
                     confidence_score=0.6
-                )
+                ), False
                 
         except Exception as e:
             logger.error(f"Gemini API error: {e}")
@@ -98,4 +180,4 @@ No additional text, explanations, or formatting - just the JSON object.
                 suggested_price=round(fallback_price, 2),
                 reasoning=f"Emergency fallback pricing due to API error: {str(e)}. Applied {markup_percentage*100-100}% markup.",
                 confidence_score=0.5
-            )
+            ), False
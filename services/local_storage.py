@@ -1,150 +1,311 @@
-import json
+import aiofiles
+import asyncio
+import hashlib
+import logging
+import numpy as np
+import orjson
 import os
+import re
+from functools import lru_cache
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from models import User
 
+logger = logging.getLogger(__name__)
+
+# Keep only the most recent suggestions per user; the append-only log is
+# compacted back down to this many entries once it grows past COMPACT_AFTER
+MAX_SUGGESTIONS = 100
+COMPACT_AFTER = 200
+
+# Anything other than letters, digits, '-' and '_' is dropped from file names
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w-]+")
+
+
+@lru_cache(maxsize=4096)
+def _clean_user_id(user_id: str) -> str:
+    """Strip characters that aren't safe in a file name from a user id"""
+    return _UNSAFE_FILENAME_CHARS.sub("", user_id)
+
+
 class LocalStorageService:
     """
     Local file-based storage as fallback when MongoDB is unavailable
+    
+    Each user's suggestions are kept as append-only NDJSON logs, one per day,
+    under local_data/<hash prefix>/user_<id>/YYYY-MM-DD.ndjson. A save writes
+    one line to the current day's file, and reads walk the files newest first,
+    stopping once they have enough suggestions
+    
+    Appends, compaction and legacy migration for a user run under that
+    user's lock, so a rewrite can't interleave with (and drop) an append
     """
     def __init__(self):
         self.storage_dir = "local_data"
+        # user_id -> number of lines currently across the user's day files
+        self._line_counts: Dict[str, int] = {}
+        # user_id -> (version of the day files, total suggestions, prices)
+        self._price_cache: Dict[str, tuple[tuple, int, np.ndarray]] = {}
+        # user_id -> lock serialising writes to the user's files
+        self._locks: Dict[str, asyncio.Lock] = {}
         self.ensure_storage_dir()
     
     def ensure_storage_dir(self):
         """Create storage directory if it doesn't exist"""
         if not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
-            print(f"📁 Created local storage directory: {self.storage_dir}")
+            logger.info("Created local storage directory: %s", self.storage_dir)
+    
+    def get_user_dir(self, user_id: str) -> str:
+        """Get the directory holding a user's day files"""
+        # A one-byte hash prefix spreads users over at most 256 directories
+        prefix = hashlib.blake2s(user_id.encode(), digest_size=1).hexdigest()
+        return os.path.join(self.storage_dir, prefix, f"user_{_clean_user_id(user_id)}")
     
-    def get_user_file_path(self, user_id: str) -> str:
-        """Get the file path for a user's data"""
-        # Clean user_id for filename (remove special characters)
-        clean_user_id = "".join(c for c in user_id if c.isalnum() or c in ('-', '_'))
-        return os.path.join(self.storage_dir, f"user_{clean_user_id}.json")
+    def get_user_file_path(self, user_id: str, day: str) -> str:
+        """Get the file path for a user's data on a given YYYY-MM-DD day"""
+        return os.path.join(self.get_user_dir(user_id), f"{day}.ndjson")
     
-    def load_user_data(self, user_id: str) -> List[dict]:
-        """Load user's price suggestions from local file"""
+    def _user_lock(self, user_id: str) -> asyncio.Lock:
+        """Get the lock guarding writes to a user's files"""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+    
+    def _day_files(self, user_id: str) -> List[str]:
+        """A user's day files, newest first"""
+        user_dir = self.get_user_dir(user_id)
         try:
-            file_path = self.get_user_file_path(user_id)
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    return data.get('suggestions', [])
+            names = [name for name in os.listdir(user_dir) if name.endswith(".ndjson")]
+        except FileNotFoundError:
             return []
+        return [os.path.join(user_dir, name) for name in sorted(names, reverse=True)]
+    
+    @staticmethod
+    async def _read_lines(file_path: str) -> List[bytes]:
+        """Non-empty lines of a day file, oldest first"""
+        async with aiofiles.open(file_path, 'rb') as f:
+            return [line for line in await f.readlines() if line.strip()]
+    
+    async def _ensure_migrated(self, user_id: str):
+        """Migrate any legacy log for the user, holding the user's lock"""
+        async with self._user_lock(user_id):
+            await self._migrate_legacy_file(user_id)
+    
+    async def _migrate_legacy_file(self, user_id: str):
+        """
+        Move a user's old single-document JSON file into day files
+        (the caller holds the user's lock)
+        """
+        legacy_path = os.path.join(self.storage_dir, f"user_{_clean_user_id(user_id)}.json")
+        if not os.path.exists(legacy_path):
+            return
+        
+        async with aiofiles.open(legacy_path, 'rb') as f:
+            data = orjson.loads(await f.read())
+        
+        # Raises if the day files couldn't be written, keeping the legacy file
+        await self.save_user_data(user_id, data.get('suggestions', []))
+        os.remove(legacy_path)
+        logger.info("Migrated %s to %s", legacy_path, self.get_user_dir(user_id))
+    
+    async def _count_lines(self, user_id: str) -> int:
+        """Count the suggestions across all of a user's day files"""
+        total = 0
+        for file_path in self._day_files(user_id):
+            total += len(await self._read_lines(file_path))
+        return total
+    
+    async def _read_newest(self, user_id: str, count: int) -> List[dict]:
+        """Read up to `count` of the user's most recent suggestions, newest first"""
+        suggestions = []
+        for file_path in self._day_files(user_id):
+            if len(suggestions) >= count:
+                break
+            try:
+                lines = await self._read_lines(file_path)
+            except FileNotFoundError:
+                # Dropped by a compaction since the directory was listed
+                continue
+            for line in reversed(lines):
+                suggestions.append(orjson.loads(line))
+                if len(suggestions) >= count:
+                    break
+        return suggestions
+    
+    async def load_user_data(self, user_id: str) -> List[dict]:
+        """Load user's most recent price suggestions (oldest first) from local files"""
+        try:
+            await self._ensure_migrated(user_id)
+            suggestions = await self._read_newest(user_id, MAX_SUGGESTIONS)
+            suggestions.reverse()
+            return suggestions
         except Exception as e:
-            print(f"❌ Error loading user data: {e}")
+            logger.error("Error loading user data: %s", e)
             return []
     
-    def save_user_data(self, user_id: str, suggestions: List[dict]):
-        """Save user's price suggestions to local file"""
+    async def save_user_data(self, user_id: str, suggestions: List[dict]):
+        """
+        Rewrite user's price suggestions into day files (used for migration
+        and compaction; the caller holds the user's lock)
+        Raises if the files couldn't be written
+        """
         try:
-            file_path = self.get_user_file_path(user_id)
-            data = {
-                'user_id': user_id,
-                'suggestions': suggestions,
-                'last_updated': datetime.utcnow().isoformat()
-            }
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=2, default=str)
-            print(f"💾 Saved user data to {file_path}")
+            by_day: Dict[str, List[dict]] = {}
+            for suggestion in sorted(suggestions, key=lambda x: str(x.get('timestamp', ''))):
+                day = str(suggestion.get('timestamp', ''))[:10] or "unknown"
+                by_day.setdefault(day, []).append(suggestion)
+            
+            os.makedirs(self.get_user_dir(user_id), exist_ok=True)
+            keep = set()
+            for day, day_suggestions in by_day.items():
+                file_path = self.get_user_file_path(user_id, day)
+                tmp_path = f"{file_path}.tmp"
+                payload = b"".join(orjson.dumps(suggestion, default=str) + b"\n" for suggestion in day_suggestions)
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    await f.write(payload)
+                os.replace(tmp_path, file_path)
+                keep.add(file_path)
+            
+            for file_path in self._day_files(user_id):
+                if file_path not in keep:
+                    os.remove(file_path)
+            
+            self._line_counts[user_id] = len(suggestions)
+            logger.debug("Saved user data to %s", self.get_user_dir(user_id))
         except Exception as e:
-            print(f"❌ Error saving user data: {e}")
+            logger.error("Error saving user data: %s", e)
+            raise
+    
+    async def append_user_data(self, user_id: str, suggestion: dict):
+        """
+        Append a single suggestion to the user's log for the suggestion's day
+        (the caller holds the user's lock)
+        """
+        os.makedirs(self.get_user_dir(user_id), exist_ok=True)
+        file_path = self.get_user_file_path(user_id, suggestion["timestamp"][:10])
+        async with aiofiles.open(file_path, 'ab') as f:
+            await f.write(orjson.dumps(suggestion, default=str) + b"\n")
+        self._line_counts[user_id] = self._line_counts.get(user_id, 0) + 1
+        logger.debug("Appended user data to %s", file_path)
     
     async def save_price_suggestion(self, user: User, suggestion_data: dict) -> str:
         """Save a price suggestion for a user"""
         try:
-            # Load existing suggestions
-            suggestions = self.load_user_data(user.sub)
-            
-            # Create new suggestion entry
-            new_suggestion = {
-                "_id": f"local_{len(suggestions)}_{int(datetime.now().timestamp())}",
-                "user_id": user.sub,
-                "product_data": suggestion_data.get("product_data", {}),
-                "suggested_price": suggestion_data.get("suggested_price"),
-                "reasoning": suggestion_data.get("reasoning"),
-                "confidence_score": suggestion_data.get("confidence_score"),
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            # Add to suggestions list
-            suggestions.append(new_suggestion)
-            
-            # Keep only last 100 suggestions per user
-            suggestions = suggestions[-100:]
-            
-            # Save to file
-            self.save_user_data(user.sub, suggestions)
+            async with self._user_lock(user.sub):
+                if user.sub not in self._line_counts:
+                    # First write since startup: learn the current log length
+                    await self._migrate_legacy_file(user.sub)
+                    self._line_counts[user.sub] = await self._count_lines(user.sub)
+                
+                # Create new suggestion entry
+                new_suggestion = {
+                    "_id": f"local_{self._line_counts[user.sub]}_{int(datetime.now().timestamp())}",
+                    "user_id": user.sub,
+                    "product_data": suggestion_data.get("product_data", {}),
+                    "suggested_price": suggestion_data.get("suggested_price"),
+                    "reasoning": suggestion_data.get("reasoning"),
+                    "confidence_score": suggestion_data.get("confidence_score"),
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                
+                await self.append_user_data(user.sub, new_suggestion)
+                
+                # Keep only last MAX_SUGGESTIONS per user, compacting lazily
+                if self._line_counts[user.sub] > COMPACT_AFTER:
+                    suggestions = await self._read_newest(user.sub, MAX_SUGGESTIONS)
+                    suggestions.reverse()
+                    try:
+                        await self.save_user_data(user.sub, suggestions)
+                    except Exception:
+                        # The suggestion itself is saved; compaction retries
+                        # on the next save
+                        pass
             
             return new_suggestion["_id"]
             
         except Exception as e:
-            print(f"❌ Error saving price suggestion: {e}")
+            logger.error("Error saving price suggestion: %s", e)
             raise
     
     async def get_user_suggestions(self, user: User, limit: int = 50, skip: int = 0) -> List[dict]:
-        """Get price suggestions for a user"""
+        """Get price suggestions for a user, newest first"""
         try:
-            suggestions = self.load_user_data(user.sub)
+            await self._ensure_migrated(user.sub)
             
-            # Sort by timestamp (newest first)
-            suggestions.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+            # Only read as many day files as the requested window needs
+            count = min(skip + limit, MAX_SUGGESTIONS)
+            suggestions = await self._read_newest(user.sub, count)
             
             # Apply skip and limit
             return suggestions[skip:skip + limit]
             
         except Exception as e:
-            print(f"❌ Error retrieving user suggestions: {e}")
+            logger.error("Error retrieving user suggestions: %s", e)
             raise
     
+    @staticmethod
+    def _parse_price(price) -> Optional[float]:
+        """Normalise a stored price (number or "$1,234.50"-style string)"""
+        try:
+            if isinstance(price, str):
+                # Remove currency symbols and convert to float
+                return float(price.replace('$', '').replace(',', '').strip())
+            if isinstance(price, (int, float)):
+                return float(price)
+        except ValueError:
+            pass
+        return None
+    
+    async def _load_prices(self, user_id: str) -> tuple[int, np.ndarray]:
+        """
+        Get (total suggestions, prices array) for a user, reusing the parsed
+        array while the user's day files are unchanged
+        """
+        try:
+            version = tuple(
+                (file_path, stat.st_mtime_ns, stat.st_size)
+                for file_path in self._day_files(user_id)
+                for stat in (os.stat(file_path),)
+            ) or None
+        except FileNotFoundError:
+            version = None
+        
+        cached = self._price_cache.get(user_id)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        
+        suggestions = await self.load_user_data(user_id)
+        parsed = (self._parse_price(suggestion.get('suggested_price')) for suggestion in suggestions)
+        prices = np.fromiter((p for p in parsed if p is not None), dtype=np.float64)
+        
+        if version is not None:
+            self._price_cache[user_id] = (version, len(suggestions), prices)
+        return len(suggestions), prices
+    
     async def get_suggestions_stats(self, user: User) -> dict:
         """Get statistics about user's price suggestions"""
         try:
-            suggestions = self.load_user_data(user.sub)
-            
-            if not suggestions:
-                return {
-                    "total_suggestions": 0,
-                    "average_price": 0,
-                    "min_price": 0,
-                    "max_price": 0
-                }
-            
-            prices = []
-            for suggestion in suggestions:
-                price = suggestion.get('suggested_price')
-                if price is not None:
-                    try:
-                        # Handle different price formats
-                        if isinstance(price, str):
-                            # Remove currency symbols and convert to float
-                            price_str = price.replace('$', '').replace(',', '').strip()
-                            price = float(price_str)
-                        elif isinstance(price, (int, float)):
-                            price = float(price)
-                        prices.append(price)
-                    except (ValueError, TypeError):
-                        continue
+            total, prices = await self._load_prices(user.sub)
             
-            if not prices:
+            if not prices.size:
                 return {
-                    "total_suggestions": len(suggestions),
+                    "total_suggestions": total,
                     "average_price": 0,
                     "min_price": 0,
                     "max_price": 0
                 }
             
             return {
-                "total_suggestions": len(suggestions),
-                "average_price": sum(prices) / len(prices),
-                "min_price": min(prices),
-                "max_price": max(prices)
+                "total_suggestions": total,
+                "average_price": float(prices.mean()),
+                "min_price": float(prices.min()),
+                "max_price": float(prices.max())
             }
             
         except Exception as e:
-            print(f"❌ Error getting suggestions stats: {e}")
+            logger.error("Error getting suggestions stats: %s", e)
             raise
 
 # Global local storage instance